@@ -0,0 +1,284 @@
+import os, struct, sys
+from qromp_cli import (
+    add_apply_arguments, add_create_arguments, add_create_bps_options,
+    add_create_ips_options, check_apply_args, check_create_args,
+    write_patched_file
+)
+from qromp_compress import open_patch, read_patch_start
+
+# qromp.py is run once per file by other programs, so it starts as fast as
+# possible: the patch engines (qromp_bps etc.) are imported only when needed
+# and argparse (which takes longer to import than everything else) only if
+# the command line has options or is invalid (see parse_simple_args())
+
+# file name extensions of compressed containers (see qromp_compress.py)
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+# positional arguments of commands that parse_simple_args() understands;
+# the last argument of "verify" is optional
+SIMPLE_COMMANDS = {
+    "apply": ("orig_file", "patch_file", "output_file"),
+    "info": ("patch_file",),
+    "verify": ("orig_file", "patch_file", "modified_file"),
+}
+
+def parse_simple_args(argv):
+    # parse a command line without options or the "create" command without
+    # argparse; return the same namespace as get_parser().parse_args() or None
+    # if argparse is needed
+
+    if not argv or argv[0] not in SIMPLE_COMMANDS \
+    or any(arg.startswith("-") for arg in argv):
+        return None
+
+    (command, *values) = argv
+    names = SIMPLE_COMMANDS[command]
+    if command == "verify" and len(values) == len(names) - 1:
+        values.append("")
+    if len(values) != len(names):
+        return None
+
+    args = dict(zip(names, values), command=command)
+    if command == "apply":
+        args.update(verbose=False, reverse_patch="")
+    import types
+    return types.SimpleNamespace(**args)
+
+def get_parser(command):
+    # return an argparse parser for all commands; only the arguments of the
+    # given command are added (the others would only slow down startup)
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Qalle's ROM Patcher. Applies, creates, describes or "
+        "verifies BPS and IPS patches. The format of patches to read is "
+        "detected from their contents."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    apply = subparsers.add_parser(
+        "apply", help="Apply a BPS/IPS patch to a file."
+    )
+    create = subparsers.add_parser(
+        "create",
+        help="Create a BPS/IPS patch from the differences of two files."
+    )
+    info = subparsers.add_parser(
+        "info", help="Print information on a BPS/IPS patch."
+    )
+    verify = subparsers.add_parser(
+        "verify",
+        help="Apply a BPS/IPS patch without writing the result and check it "
+        "against modified_file or (BPS only) the CRC32s in the patch."
+    )
+
+    if command == "apply":
+        add_apply_arguments(apply, ".bps/.ips", True)
+    elif command == "create":
+        create.add_argument(
+            "-f", "--format", choices=("bps", "ips"),
+            help="Patch format. Default: from patch_file extension."
+        )
+        add_create_bps_options(create.add_argument_group("BPS options"))
+        add_create_ips_options(create.add_argument_group("IPS options"))
+        add_create_arguments(create, ".bps/.ips")
+    elif command == "info":
+        info.add_argument(
+            "patch_file",
+            help="Patch file (.bps/.ips, may be compressed) to read."
+        )
+    elif command == "verify":
+        verify.add_argument(
+            "orig_file", help="Original (unpatched) file to read."
+        )
+        verify.add_argument(
+            "patch_file",
+            help="Patch file (.bps/.ips, may be compressed) to read."
+        )
+        verify.add_argument(
+            "modified_file", nargs="?", default="",
+            help="Expected patched file. Required for IPS patches."
+        )
+
+    return parser
+
+def parse_args():
+    # parse and validate command line arguments
+
+    args = parse_simple_args(sys.argv[1:])
+    if args is None:
+        command = sys.argv[1] if len(sys.argv) > 1 else ""
+        args = get_parser(command).parse_args()
+
+    if args.command == "apply":
+        check_apply_args(args)
+        if args.reverse_patch \
+        and detect_format(read_patch_start(args.patch_file, 5)) != "bps":
+            sys.exit("Reverse patches can only be created from BPS patches.")
+    elif args.command == "create":
+        if args.format is None:
+            name = args.patch_file.lower()
+            for ext in COMPRESSED_EXTENSIONS:
+                name = name.removesuffix(ext)
+            if name.endswith(".bps"):
+                args.format = "bps"
+            elif name.endswith(".ips"):
+                args.format = "ips"
+            else:
+                sys.exit("Can't detect patch format; use '--format'.")
+        check_create_args(args)
+    elif args.command == "info":
+        if not os.path.isfile(args.patch_file):
+            sys.exit("Patch file not found.")
+    else:
+        if not os.path.isfile(args.orig_file):
+            sys.exit("Original file not found.")
+        if not os.path.isfile(args.patch_file):
+            sys.exit("Patch file not found.")
+        if args.modified_file:
+            if not os.path.isfile(args.modified_file):
+                sys.exit("Modified file not found.")
+        elif detect_format(read_patch_start(args.patch_file, 5)) != "bps":
+            sys.exit("IPS patches can only be verified against modified_file.")
+
+    return args
+
+def detect_format(id_):
+    # detect patch format from the first bytes of a patch; return "bps" or
+    # "ips"
+    if id_.startswith(b"BPS"):
+        return "bps"
+    if id_[:5] in (b"PATCH", b"IPS32"):
+        return "ips"
+    sys.exit("Unknown patch format.")
+
+def apply_patch(origHnd, patchHnd, verbose, trace=None):
+    # apply a BPS/IPS patch; return (format, original data, patched data,
+    # (CRC32 of original data, CRC32 of patched data)); for IPS, original
+    # data and CRC32s are None;
+    # trace: see qromp_bps.decode_blocks()
+    patchHnd.seek(0)
+    format_ = detect_format(patchHnd.read(5))
+    if format_ == "bps":
+        from qromp_bps import apply_bps
+        return (format_,) + apply_bps(origHnd, patchHnd, verbose, trace)
+    from qromp_ips import apply_ips
+    return (format_, None, apply_ips(origHnd, patchHnd, verbose), None)
+
+def command_apply(args):
+    trace = [] if args.reverse_patch else None
+    try:
+        with open(args.orig_file, "rb") as origHnd, \
+        open_patch(args.patch_file) as patchHnd:
+            (format_, origData, patchedData, crcs) \
+            = apply_patch(origHnd, patchHnd, args.verbose, trace)
+    except OSError:
+        sys.exit("Error reading input files.")
+
+    write_patched_file(args.output_file, patchedData)
+
+    if args.reverse_patch:
+        from qromp_bps import write_reverse_patch
+        write_reverse_patch(
+            args.reverse_patch, origData, patchedData, trace, crcs
+        )
+
+def command_create(args):
+    if args.format == "bps":
+        from qromp_enc_bps import write_bps
+        write_bps(args.orig_file, args.modified_file, args.patch_file, args)
+    else:
+        from qromp_enc_ips import write_ips
+        write_ips(args.orig_file, args.modified_file, args.patch_file, args)
+
+def print_bps_info(patchHnd):
+    # print header, block statistics and footer of a BPS patch
+    from qromp_bps import (
+        FOOTER_SIZE, get_block_stats, print_block_stats, read_bytes, read_int
+    )
+
+    patchHnd.seek(0)
+    version = read_bytes(4, patchHnd)[3:].decode("ascii", errors="replace")
+    print(f"Format: BPS, version {version!r}.")
+    print(
+        f"File sizes: original={read_int(patchHnd)}, "
+        f"patched={read_int(patchHnd)}."
+    )
+    metadataSize = read_int(patchHnd)
+    if metadataSize:
+        metadata = read_bytes(metadataSize, patchHnd)
+        print("Metadata:", metadata.decode("ascii", errors="replace"))
+    else:
+        print("No metadata.")
+
+    print_block_stats(*get_block_stats(patchHnd))
+
+    footer = read_bytes(FOOTER_SIZE, patchHnd)
+    print(
+        "CRC32s: input={:08x}, output={:08x}, patch={:08x}.".format(
+            *struct.unpack("<3L", footer)
+        )
+    )
+
+def print_ips_info(patchHnd):
+    # print block statistics of an IPS patch
+    from qromp_ips import decode_int, get_block_stats, print_block_stats
+
+    patchHnd.seek(0)
+    id_ = patchHnd.read(5)
+    print(f"Format: {'IPS' if id_ == b'PATCH' else 'IPS32'}.")
+    eofMarker = b"EOF" if id_ == b"PATCH" else b"EEOF"
+
+    (blkCnts, blkByteCnts, maxEnd) = get_block_stats(patchHnd, eofMarker)
+    print_block_stats(blkCnts, blkByteCnts)
+    print(f"End of last block: {maxEnd}.")
+
+    truncSize = patchHnd.read(len(eofMarker))
+    if len(truncSize) == len(eofMarker):
+        print(f"Truncates to {decode_int(truncSize)} bytes.")
+
+def command_info(args):
+    try:
+        with open_patch(args.patch_file) as patchHnd:
+            if detect_format(patchHnd.read(5)) == "bps":
+                print_bps_info(patchHnd)
+            else:
+                print_ips_info(patchHnd)
+    except OSError:
+        sys.exit("Error reading patch file.")
+
+def command_verify(args):
+    try:
+        with open(args.orig_file, "rb") as origHnd, \
+        open_patch(args.patch_file) as patchHnd:
+            (format_, origData, patchedData, crcs) \
+            = apply_patch(origHnd, patchHnd, False)
+            if format_ == "bps":
+                # CRC32s of original and patched file from footer
+                patchHnd.seek(-3 * 4, 2)
+                expectedCrcs = struct.unpack("<2L", patchHnd.read(2 * 4))
+        if args.modified_file:
+            with open(args.modified_file, "rb") as handle:
+                modifiedData = handle.read()
+    except OSError:
+        sys.exit("Error reading input files.")
+
+    if args.modified_file:
+        if patchedData != modifiedData:
+            sys.exit("Verification failed: patched data differs.")
+    else:
+        # BPS (IPS without modified_file was rejected in parse_args())
+        if expectedCrcs != crcs:
+            sys.exit("Verification failed: CRC32 mismatch.")
+    print("Verification OK.")
+
+def main():
+    args = parse_args()
+    {
+        "apply": command_apply,
+        "create": command_create,
+        "info": command_info,
+        "verify": command_verify,
+    }[args.command](args)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-import argparse, os, struct, sys
-from zlib import crc32
+import struct, sys
+from qromp_cli import add_apply_arguments, check_apply_args, write_patched_file
+from qromp_compress import open_patch, open_patch_for_writing
+from qromp_crc import finish_crc32, parallel_crc32, start_crc32
 
 # enumerate BPS actions (types of blocks);
 # note that "source" and "target" here refer to *encoder*'s input files
@@ -10,37 +12,15 @@ ACTION_DESCRIPTIONS = ("SourceRead", "TargetRead", "SourceCopy", "TargetCopy")
 FOOTER_SIZE = 3 * 4
 
 def parse_args():
-    # parse command line arguments
-
+    # parse command line arguments; argparse is imported here because
+    # qromp.py uses this module and usually doesn't need it
+    import argparse
     parser = argparse.ArgumentParser(
         description="Qalle's BPS Patcher. Applies a BPS patch to a file."
     )
-
-    parser.add_argument(
-        "-v", "--verbose", action="store_true",
-        help="Print more info. (CRC32 checksums are of zlib variety and "
-        "hexadecimal.)"
-    )
-
-    parser.add_argument(
-        "orig_file", help="Original (unpatched) file to read."
-    )
-    parser.add_argument(
-        "patch_file", help="Patch file (.bps) to read."
-    )
-    parser.add_argument(
-        "output_file", help="Patched copy of orig_file to write."
-    )
-
+    add_apply_arguments(parser, ".bps", True)
     args = parser.parse_args()
-
-    if not os.path.isfile(args.orig_file):
-        sys.exit("Original file not found.")
-    if not os.path.isfile(args.patch_file):
-        sys.exit("Patch file not found.")
-    if os.path.exists(args.output_file):
-        sys.exit("Output file already exists.")
-
+    check_apply_args(args)
     return args
 
 def read_bytes(n, handle):
@@ -74,12 +54,37 @@ def read_signed_int(handle):
     n = read_int(handle)
     return (-1 if n & 1 else 1) * (n >> 1)
 
-def decode_blocks(srcData, patchHnd, verbose):
+def encode_int(n):
+    # convert a nonnegative integer into BPS format; return bytes;
+    # final byte has MSB set, all other bytes have MSB clear (see read_int())
+
+    encoded = bytearray()
+    while True:
+        if n <= 0x7f:
+            encoded.append(n | 0x80)
+            break
+        encoded.append(n & 0x7f)
+        n = (n >> 7) - 1
+    return bytes(encoded)
+
+def encode_signed_int(n):
+    # encode a signed BPS integer
+    return encode_int((abs(n) << 1) | (1 if n < 0 else 0))
+
+def block_start(length, action):
+    # encode start of block
+    return encode_int(((length - 1) << 2) | action)
+
+def decode_blocks(srcData, patchHnd, verbose, trace=None):
     # decode blocks from BPS file (slices from input file, patch file or
-    # previous output)
+    # previous output);
+    # if trace is a list, append (action, address in output, address to copy
+    # from, length) of each block to it
 
     # get patch size without disturbing file handle position
-    patchSize = os.stat(patchHnd.fileno()).st_size
+    patchPos = patchHnd.tell()
+    patchSize = patchHnd.seek(0, 2)
+    patchHnd.seek(patchPos)
 
     dstData = bytearray()  # output data
     srcOffset = 0  # read offset in srcData (used by SOURCE_COPY)
@@ -90,9 +95,6 @@ def decode_blocks(srcData, patchHnd, verbose):
             "Address in patch file / patched file size before action / "
             "action / address to copy from / bytes to output:"
         )
-        # statistics by action
-        blkCnts = 4 * [0]
-        blkByteCnts = 4 * [0]
 
     while patchHnd.tell() < patchSize - FOOTER_SIZE:
         # for statistics
@@ -136,41 +138,153 @@ def decode_blocks(srcData, patchHnd, verbose):
                 dstData.extend(dstData[origDstOffset:origDstOffset+chunkSize])
                 dstOffset += chunkSize
 
-        if verbose:
+        if verbose or trace is not None:
             srcAddr = {
                 SOURCE_READ: origDstSize,
                 TARGET_READ: patchHnd.tell() - length,
                 SOURCE_COPY: srcOffset - length,
                 TARGET_COPY: dstOffset - length,
             }[action]
+            if trace is not None:
+                trace.append((action, origDstSize, srcAddr, length))
+
+        if verbose:
             print(
                 f"{origPatchPos:10} {origDstSize:10} "
                 f"{ACTION_DESCRIPTIONS[action]} {srcAddr:10} {length:10}"
             )
-            blkCnts[action] += 1
-            blkByteCnts[action] += length
 
     if verbose:
-        print("Blocks by type:")
-        for action in range(4):
-            print(
-                f"- {blkByteCnts[action]} bytes output by {blkCnts[action]} "
-                f"{ACTION_DESCRIPTIONS[action]} blocks"
-            )
+        patchHnd.seek(patchPos)
+        print_block_stats(*get_block_stats(patchHnd))
 
     return dstData
 
-def apply_bps(origHnd, patchHnd, verbose):
-    # apply BPS patch from patchHnd to origHnd, return patched data;
+def get_block_stats(patchHnd):
+    # read blocks from current position to footer without decoding them;
+    # return (number of blocks by action, bytes output by action)
+
+    # get patch size without disturbing file handle position
+    patchPos = patchHnd.tell()
+    patchSize = patchHnd.seek(0, 2)
+    patchHnd.seek(patchPos)
+
+    blkCnts = 4 * [0]
+    blkByteCnts = 4 * [0]
+    while patchHnd.tell() < patchSize - FOOTER_SIZE:
+        lengthAndAction = read_int(patchHnd)
+        length = (lengthAndAction >> 2) + 1
+        action = lengthAndAction & 3
+        if action == TARGET_READ:
+            patchHnd.seek(length, 1)
+        elif action != SOURCE_READ:
+            read_signed_int(patchHnd)
+        blkCnts[action] += 1
+        blkByteCnts[action] += length
+    return (blkCnts, blkByteCnts)
+
+def print_block_stats(blkCnts, blkByteCnts):
+    # print statistics from get_block_stats()
+    print("Blocks by type:")
+    for action in range(4):
+        print(
+            f"- {blkByteCnts[action]} bytes output by {blkCnts[action]} "
+            f"{ACTION_DESCRIPTIONS[action]} blocks"
+        )
+
+def create_reverse_bps(srcData, dstData, trace, crcs):
+    # create a BPS patch that converts dstData back to srcData using the block
+    # trace from decode_blocks() instead of searching for matches; bytes of
+    # srcData that were copied to dstData by SourceRead/SourceCopy blocks are
+    # copied back from there, the rest are stored in TargetRead blocks;
+    # crcs: (CRC32 of srcData, CRC32 of dstData) from apply_bps();
+    # generate patch data except for the patch CRC at the end
+
+    # header (id, original file size, patched file size, metadata size);
+    # the roles of the files are swapped
+    yield b"BPS1"
+    yield b"".join(encode_int(n) for n in (len(dstData), len(srcData), 0))
+
+    # spans of srcData that also occur in dstData, as (start in srcData,
+    # end in srcData, start in dstData), sorted by start in srcData
+    spans = sorted(
+        (srcAddr, srcAddr + length, dstAddr)
+        for (action, dstAddr, srcAddr, length) in trace
+        if action in (SOURCE_READ, SOURCE_COPY)
+    )
+
+    srcPos = 0         # position in srcData (the new patched file)
+    spanInd = 0        # index of next span not yet considered
+    bestSpan = None    # span that reaches furthest among those considered
+    trgReadStart = -1  # start of TARGET_READ in srcData (-1 = none)
+    srcCopyOffset = 0  # SOURCE_COPY's position in dstData
+
+    while srcPos < len(srcData):
+        # greedily pick the span that covers srcPos and reaches furthest
+        while spanInd < len(spans) and spans[spanInd][0] <= srcPos:
+            if bestSpan is None or spans[spanInd][1] > bestSpan[1]:
+                bestSpan = spans[spanInd]
+            spanInd += 1
+
+        if bestSpan is None or bestSpan[1] <= srcPos:
+            # not covered; store bytes until the next span starts
+            if trgReadStart == -1:
+                trgReadStart = srcPos
+            if spanInd < len(spans):
+                srcPos = spans[spanInd][0]
+            else:
+                srcPos = len(srcData)
+            continue
+
+        length = bestSpan[1] - srcPos
+        copyPos = bestSpan[2] + srcPos - bestSpan[0]
+        if copyPos == srcPos:
+            action = SOURCE_READ
+        else:
+            action = SOURCE_COPY
+            offsetBytes = encode_signed_int(copyPos - srcCopyOffset)
+            if length <= len(offsetBytes):
+                # storing the bytes is cheaper than pointing to them
+                if trgReadStart == -1:
+                    trgReadStart = srcPos
+                srcPos += length
+                continue
+
+        # end a TARGET_READ block before any other block
+        if trgReadStart != -1:
+            yield block_start(srcPos - trgReadStart, TARGET_READ)
+            yield srcData[trgReadStart:srcPos]
+            trgReadStart = -1
+
+        yield block_start(length, action)
+        if action == SOURCE_COPY:
+            yield offsetBytes
+            srcCopyOffset = copyPos + length
+        srcPos += length
+
+    # end final TARGET_READ block
+    if trgReadStart != -1:
+        yield block_start(len(srcData) - trgReadStart, TARGET_READ)
+        yield srcData[trgReadStart:]
+
+    # footer except for patch CRC (source/target file CRC)
+    yield struct.pack("<2L", crcs[1], crcs[0])
+
+def apply_bps(origHnd, patchHnd, verbose, trace=None):
+    # apply BPS patch from patchHnd to origHnd; return (original data, patched
+    # data, (CRC32 of original data, CRC32 of patched data));
+    # trace: see decode_blocks();
     # see https://gist.github.com/khadiwala/32550f44efcc36a5b6a470ff2d4c9c22
 
     origHnd.seek(0)
     srcData = origHnd.read()
 
-    # get CRC of patch (except for CRC at the end) for later use
+    # start computing CRCs of original file and patch (except for CRC at the
+    # end) in the background while decoding
+    srcCrcJobs = start_crc32(srcData)
     patchSize = patchHnd.seek(0, 2)
     patchHnd.seek(0)
-    patchCrc = crc32(patchHnd.read(patchSize - 4))
+    patchCrcJobs = start_crc32(patchHnd.read(patchSize - 4))
     patchHnd.seek(0)
 
     # header - file format id
@@ -200,7 +314,7 @@ def apply_bps(origHnd, patchHnd, verbose):
         print("No metadata.")
 
     # create output data by repeatedly appending data
-    dstData = decode_blocks(srcData, patchHnd, verbose)
+    dstData = decode_blocks(srcData, patchHnd, verbose, trace)
 
     # validate output size
     if hdrDstSize != len(dstData):
@@ -216,32 +330,47 @@ def apply_bps(origHnd, patchHnd, verbose):
             "Expected CRC32s: input={:08x}, output={:08x}, patch={:08x}."
             .format(*expectedCrcs)
         )
-    if expectedCrcs[0] != crc32(srcData):
+    crcs = (finish_crc32(srcCrcJobs), parallel_crc32(dstData))
+    if expectedCrcs[0] != crcs[0]:
         print("Warning: original file CRC mismatch.", file=sys.stderr)
-    if expectedCrcs[1] != crc32(dstData):
+    if expectedCrcs[1] != crcs[1]:
         print("Warning: patched file CRC mismatch.", file=sys.stderr)
-    if expectedCrcs[2] != patchCrc:
+    if expectedCrcs[2] != finish_crc32(patchCrcJobs):
         print("Warning: patch file CRC mismatch.", file=sys.stderr)
 
-    return dstData
+    return (srcData, dstData, crcs)
+
+def write_reverse_patch(path, origData, patchedData, trace, crcs):
+    # create a reverse patch with create_reverse_bps() and write it
+    patch = bytearray()
+    for chunk in create_reverse_bps(origData, patchedData, trace, crcs):
+        patch.extend(chunk)
+    patch.extend(struct.pack("<L", parallel_crc32(patch)))
+    try:
+        with open_patch_for_writing(path) as handle:
+            handle.write(patch)
+    except OSError:
+        sys.exit("Error writing reverse patch file.")
 
 def main():
     args = parse_args()
 
     # create patched data
+    trace = [] if args.reverse_patch else None
     try:
         with open(args.orig_file, "rb") as origHnd, \
-        open(args.patch_file, "rb") as patchHnd:
-            patchedData = apply_bps(origHnd, patchHnd, args.verbose)
+        open_patch(args.patch_file) as patchHnd:
+            (origData, patchedData, crcs) \
+            = apply_bps(origHnd, patchHnd, args.verbose, trace)
     except OSError:
         sys.exit("Error reading input files.")
 
-    # write patched data
-    try:
-        with open(args.output_file, "wb") as handle:
-            handle.seek(0)
-            handle.write(patchedData)
-    except OSError:
-        sys.exit("Error writing output file.")
+    write_patched_file(args.output_file, patchedData)
+
+    if args.reverse_patch:
+        write_reverse_patch(
+            args.reverse_patch, origData, patchedData, trace, crcs
+        )
 
-main()
+if __name__ == "__main__":
+    main()
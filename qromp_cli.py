@@ -0,0 +1,136 @@
+# command line arguments and output file writing shared by the programs; not a
+# program itself; doesn't import the patch engines so qromp.py stays fast to
+# start
+
+import os, sys
+
+def add_apply_arguments(parser, patchExt, reverse):
+    # add arguments for applying a patch to an argparse parser;
+    # patchExt: file name extension(s) of the patch to mention in help;
+    # reverse: add '--reverse-patch' (BPS only)
+
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="Print more info. (CRC32 checksums are of zlib variety and "
+        "hexadecimal.)"
+    )
+
+    if reverse:
+        parser.add_argument(
+            "-r", "--reverse-patch", type=str, default="",
+            help="Also write a reverse patch (.bps) that converts output_file "
+            "back to orig_file (BPS patches only). Built from the blocks "
+            "decoded while patching; much faster than creating it with "
+            "qromp_enc_bps.py but less efficient. Compressed if the name ends "
+            "with '.gz', '.bz2' or '.xz'. Default=none."
+        )
+
+    parser.add_argument(
+        "orig_file", help="Original (unpatched) file to read."
+    )
+    parser.add_argument(
+        "patch_file",
+        help=f"Patch file ({patchExt}) to read. May be compressed with gzip, "
+        "bzip2 or xz."
+    )
+    parser.add_argument(
+        "output_file", help="Patched copy of orig_file to write."
+    )
+
+def check_apply_args(args):
+    # validate arguments from add_apply_arguments()
+    if not os.path.isfile(args.orig_file):
+        sys.exit("Original file not found.")
+    if not os.path.isfile(args.patch_file):
+        sys.exit("Patch file not found.")
+    if os.path.exists(args.output_file):
+        sys.exit("Output file already exists.")
+    reversePatch = getattr(args, "reverse_patch", "")
+    if reversePatch and os.path.exists(reversePatch):
+        sys.exit("Reverse patch file already exists.")
+
+def add_create_bps_options(parser):
+    # add options for creating a BPS patch to an argparse parser or group
+
+    parser.add_argument(
+        "--min-copy-len", type=int, default=4,
+        help="Minimum length of substrings to copy from original or patched "
+        "file. 1-32, default=4. A larger value is usually faster but less "
+        "efficient and requires more memory."
+    )
+    parser.add_argument(
+        "--metadata", type=str, default="",
+        help="Metadata to save in the patch file, in ASCII. Default=none."
+    )
+
+    parser.add_argument(
+        "--update-from", type=str, default="",
+        help="Previous patch (.bps) from orig_file to an earlier version of "
+        "modified_file. Its blocks are reused for regions that haven't "
+        "changed and only the other regions are searched. Much faster for "
+        "small edits. May be compressed with gzip, bzip2 or xz. "
+        "Default=none."
+    )
+
+def add_create_ips_options(parser):
+    # add options for creating an IPS patch to an argparse parser or group
+
+    parser.add_argument(
+        "--min-rle-len", type=int, default=9,
+        help="Minimum length of blocks to encode as RLE. 1-16, default=9. "
+        "Affects efficiency."
+    )
+    parser.add_argument(
+        "--max-unchg-len", type=int, default=1,
+        help="Maximum length of unchanged substring to store. 0-16, "
+        "default=1. Affects efficiency."
+    )
+
+def add_create_arguments(parser, patchExt):
+    # add positional arguments for creating a patch to an argparse parser;
+    # patchExt: file name extension(s) of the patch to mention in help
+
+    parser.add_argument(
+        "orig_file", help="Original file to read."
+    )
+    parser.add_argument(
+        "modified_file", help="File to read and compare against orig_file."
+    )
+    parser.add_argument(
+        "patch_file",
+        help=f"Patch file to write ({patchExt}). Compressed if the name ends "
+        "with '.gz', '.bz2' or '.xz'."
+    )
+
+def check_create_args(args):
+    # validate arguments from add_create_arguments() and the option functions
+    # that were used
+
+    argDict = vars(args)
+    if "min_copy_len" in argDict:
+        if not 1 <= args.min_copy_len <= 32:
+            sys.exit("Invalid '--min-copy-len' value.")
+        if not args.metadata.isascii():
+            sys.exit("Metadata is not ASCII.")
+    if "min_rle_len" in argDict:
+        if not 1 <= args.min_rle_len <= 16:
+            sys.exit("Invalid '--min-rle-len' value.")
+        if not 0 <= args.max_unchg_len <= 16:
+            sys.exit("Invalid '--max-unchg-len' value.")
+
+    if not os.path.isfile(args.orig_file):
+        sys.exit("Original file not found.")
+    if not os.path.isfile(args.modified_file):
+        sys.exit("Modified file not found.")
+    if argDict.get("update_from") and not os.path.isfile(args.update_from):
+        sys.exit("Previous patch file not found.")
+    if os.path.exists(args.patch_file):
+        sys.exit("Output file already exists.")
+
+def write_patched_file(path, data):
+    # write patched data
+    try:
+        with open(path, "wb") as handle:
+            handle.write(data)
+    except OSError:
+        sys.exit("Error writing output file.")
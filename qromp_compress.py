@@ -0,0 +1,75 @@
+# reading and writing of compressed patch files (gzip, bzip2, xz); used by the
+# other programs, not a program itself
+
+import importlib, io, sys, zlib
+
+# compressed containers: (magic bytes, file name extension, module name);
+# the module is only imported if the container is used
+CONTAINERS = (
+    (b"\x1f\x8b", ".gz", "gzip"),
+    (b"BZh", ".bz2", "bz2"),
+    (b"\xfd7zXZ\x00", ".xz", "lzma"),
+)
+
+def get_container_module(handle):
+    # detect the compressed container of a file by magic bytes without
+    # changing the file position; return (module, tuple of its decompression
+    # errors) or None if the file isn't compressed
+
+    pos = handle.tell()
+    magic = handle.read(max(len(c[0]) for c in CONTAINERS))
+    handle.seek(pos)
+
+    for (magic_, extension, moduleName) in CONTAINERS:
+        if magic.startswith(magic_):
+            module = importlib.import_module(moduleName)
+            errors = (OSError, EOFError, zlib.error)
+            if moduleName == "lzma":
+                errors += (module.LZMAError,)
+            return (module, errors)
+
+    return None
+
+def open_patch(path):
+    # open a patch file for reading; if it's compressed (detected by magic
+    # bytes), decompress it to memory in one pass and return a file-like
+    # object of the decompressed data
+
+    handle = open(path, "rb")
+    container = get_container_module(handle)
+    if container is None:
+        return handle
+
+    (module, errors) = container
+    try:
+        with handle, module.open(handle, "rb") as decompHnd:
+            return io.BytesIO(decompHnd.read())
+    except MemoryError:
+        sys.exit("Out of memory. (Corrupt patch file?)")
+    except errors:
+        sys.exit("Error decompressing patch file.")
+
+def read_patch_start(path, n):
+    # return the first n bytes of a patch file (decompressed if necessary)
+    # without reading the rest
+
+    with open(path, "rb") as handle:
+        container = get_container_module(handle)
+        if container is None:
+            return handle.read(n)
+        (module, errors) = container
+        try:
+            with module.open(handle, "rb") as decompHnd:
+                return decompHnd.read(n)
+        except errors:
+            sys.exit("Error decompressing patch file.")
+
+def open_patch_for_writing(path):
+    # open a patch file for writing; compress it if the file name extension is
+    # that of a compressed container (e.g. ".bps.gz")
+
+    for (magic, extension, moduleName) in CONTAINERS:
+        if path.lower().endswith(extension):
+            return importlib.import_module(moduleName).open(path, "wb")
+
+    return open(path, "wb")
@@ -0,0 +1,100 @@
+# CRC32 (zlib variety) of large data computed in chunks on a thread pool;
+# used by the other programs, not a program itself
+
+import os
+from zlib import crc32
+
+CHUNK_SIZE = 1024 * 1024  # default size of chunks to compute in parallel
+# smaller chunks are computed in the calling thread because zlib only releases
+# the GIL for larger buffers
+MIN_PARALLEL_CHUNK_SIZE = 64 * 1024
+
+POLYNOMIAL = 0xedb88320  # CRC32 polynomial, bits reversed
+
+executor = None  # thread pool, created when first needed
+
+def get_executor():
+    # return the shared thread pool
+    # (concurrent.futures is imported here because it's slow to import)
+    global executor
+    if executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    return executor
+
+def multiply_mod_p(a, b):
+    # multiply polynomials a and b modulo the CRC32 polynomial; bits are
+    # reversed (the MSB is the coefficient of x^0)
+    product = 0
+    mask = 1 << 31
+    while a:
+        if a & mask:
+            product ^= b
+            a ^= mask
+        mask >>= 1
+        b = (b >> 1) ^ POLYNOMIAL if b & 1 else b >> 1
+    return product
+
+# X_POW_2_POW[k] = x^(2^k) modulo the CRC32 polynomial
+X_POW_2_POW = [1 << 30]
+for i in range(31):
+    X_POW_2_POW.append(multiply_mod_p(X_POW_2_POW[-1], X_POW_2_POW[-1]))
+
+def crc32_combine(crc1, crc2, len2):
+    # return CRC32 of A+B, given CRC32 of A (crc1), CRC32 of B (crc2) and the
+    # length of B; appending len2 bytes multiplies crc1 by x^(8*len2)
+    power = 1 << 31  # x^0
+    exponent = 3     # 2^3 = 8 bits per byte
+    while len2:
+        if len2 & 1:
+            power = multiply_mod_p(X_POW_2_POW[exponent & 31], power)
+        len2 >>= 1
+        exponent += 1
+    return multiply_mod_p(power, crc1) ^ crc2
+
+def get_slice_crc(data, start, end):
+    # return CRC32 of data[start:end] without copying it; the memoryviews are
+    # released before returning so data can be resized afterwards
+    with memoryview(data) as view, view[start:end] as slice_:
+        return crc32(slice_)
+
+def start_crc32(data, chunkSize=CHUNK_SIZE):
+    # start computing CRC32s of chunkSize-byte chunks of data; return a list
+    # of (future or CRC32, chunk length) for finish_crc32() or
+    # finish_chunk_crcs(); the thread pool is only used if there are several
+    # large chunks
+    if 0 < len(data) <= chunkSize:
+        return [(crc32(data), len(data))]
+    if chunkSize < MIN_PARALLEL_CHUNK_SIZE:
+        submit = lambda fn, *args: fn(*args)
+    else:
+        submit = get_executor().submit
+    return [
+        (
+            submit(get_slice_crc, data, start, start + chunkSize),
+            min(chunkSize, len(data) - start)
+        ) for start in range(0, len(data), chunkSize)
+    ]
+
+def finish_chunk_crcs(jobs):
+    # wait for jobs from start_crc32(); return CRC32s of chunks as a list
+    return [
+        crc if isinstance(crc, int) else crc.result() for (crc, length) in jobs
+    ]
+
+def finish_crc32(jobs):
+    # wait for jobs from start_crc32(); return CRC32 of the whole data
+    crc = 0
+    for (chunkCrc, (_, length)) in zip(finish_chunk_crcs(jobs), jobs):
+        crc = crc32_combine(crc, chunkCrc, length)
+    return crc
+
+def get_chunk_crcs(data, chunkSize=CHUNK_SIZE):
+    # return CRC32s of chunkSize-byte chunks of data as a list
+    return finish_chunk_crcs(start_crc32(data, chunkSize))
+
+def parallel_crc32(data):
+    # return CRC32 of data
+    if len(data) <= CHUNK_SIZE:
+        return crc32(data)
+    return finish_crc32(start_crc32(data))
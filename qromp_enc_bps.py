@@ -1,94 +1,166 @@
-import argparse, os, struct, sys, time
-from zlib import crc32
+import argparse, struct, sys, time
+from qromp_bps import (
+    FOOTER_SIZE, block_start, decode_blocks, encode_int, encode_signed_int,
+    read_bytes, read_int
+)
+from qromp_cli import (
+    add_create_arguments, add_create_bps_options, check_create_args
+)
+from qromp_compress import open_patch, open_patch_for_writing
+from qromp_crc import (
+    finish_crc32, get_chunk_crcs, parallel_crc32, start_crc32
+)
 
 # enumerate actions (types of BPS blocks); note that "source" and "target" here
 # refer to encoder's *input* files
 (SOURCE_READ, TARGET_READ, SOURCE_COPY, TARGET_COPY) = range(4)
 
+# size of chunks compared when reusing a previous patch
+UPDATE_CHUNK_SIZE = 4 * 1024
+# when reusing a previous patch, the number of times to search the files
+# directly before building sets of substrings (see create_bps()); a failed
+# search costs about 1/500 of building the sets
+MAX_DIRECT_SEARCHES = 500
+
 def parse_args():
     # parse command line arguments
-
     parser = argparse.ArgumentParser(
         description="Qalle's BPS Patch Creator. Creates a BPS patch from "
         "the differences of two files. Slow."
     )
+    add_create_bps_options(parser)
+    add_create_arguments(parser, ".bps")
+    args = parser.parse_args()
+    check_create_args(args)
+    return args
 
-    parser.add_argument(
-        "--min-copy-len", type=int, default=4,
-        help="Minimum length of substrings to copy from original or patched "
-        "file. 1-32, default=4. A larger value is usually faster but less "
-        "efficient and requires more memory."
-    )
-    parser.add_argument(
-        "--metadata", type=str, default="",
-        help="Metadata to save in the patch file, in ASCII. Default=none."
-    )
-
-    parser.add_argument(
-        "orig_file", help="Original file to read."
-    )
-    parser.add_argument(
-        "modified_file", help="File to read and compare against orig_file."
-    )
-    parser.add_argument(
-        "patch_file", help="Patch file to write (.bps)."
+def get_substrings(data, length, start, end):
+    # generate the length-byte substrings of data whose last byte is in
+    # data[start:end]
+    return (
+        data[i:i+length] for i in range(
+            max(start - length + 1, 0), max(end - length + 1, 0)
+        )
     )
 
-    args = parser.parse_args()
+def find_longest_prefix(str1, str2, end):
+    # return length of longest prefix of str1 that occurs anywhere in
+    # str2[:end] using binary search
 
-    if not 1 <= args.min_copy_len <= 32:
-        sys.exit("Invalid '--min-copy-len' value.")
-    if not args.metadata.isascii():
-        sys.exit("Metadata is not ASCII.")
+    minLen = 0
+    maxLen = min(len(str1), end)
 
-    if not os.path.isfile(args.orig_file):
-        sys.exit("Original file not found.")
-    if not os.path.isfile(args.modified_file):
-        sys.exit("Modified file not found.")
-    if os.path.exists(args.patch_file):
-        sys.exit("Output file already exists.")
+    while minLen < maxLen:
+        avgLen = (minLen + maxLen + 1) // 2
+        if str2.find(str1[:avgLen], 0, end) != -1:
+            minLen = avgLen
+        else:
+            maxLen = avgLen - 1
 
-    return args
+    return minLen
 
-def encode_int(n):
-    # convert a nonnegative integer into BPS format; return bytes;
-    # final byte has MSB set, all other bytes have MSB clear;
-    # e.g. b"\x12\x34\x89" = (0x12<<0) + ((0x34+1)<<7) + ((0x09+1)<<14)
-    # = 0x29a92
-
-    encoded = bytearray()
-    while True:
-        if n <= 0x7f:
-            encoded.append(n | 0x80)
-            break
-        encoded.append(n & 0x7f)
-        n = (n >> 7) - 1
-    return bytes(encoded)
-
-def encode_signed_int(n):
-    # encode a signed BPS integer
-    return encode_int((abs(n) << 1) | (1 if n < 0 else 0))
-
-def block_start(length, action):
-    # encode start of block
-    return encode_int(((length - 1) << 2) | action)
-
-def find_longest_prefix(str1, str2):
-    # return length of longest prefix of str1 that occurs anywhere in str2
+def get_common_prefix_len(str1, str2, start, end):
+    # return length of longest prefix of str1 that occurs at str2[start:end]
     # using binary search
 
     minLen = 0
-    maxLen = min(len(str1), len(str2))
+    maxLen = max(min(len(str1), end - start), 0)
 
     while minLen < maxLen:
         avgLen = (minLen + maxLen + 1) // 2
-        if str1[:avgLen] in str2:
+        if str2.startswith(str1[:avgLen], start):
             minLen = avgLen
         else:
             maxLen = avgLen - 1
 
     return minLen
 
+def find_nearest(str1, str2, offset, end):
+    # return position of the occurrence of str1 in str2[:end] that is closest
+    # to offset (str1 must occur); searching outwards from offset is faster
+    # than from the start and finds the cheapest offset to encode
+
+    after = str2.find(str1, min(offset, end), end)
+    # only search backwards as far as the occurrence found after offset
+    before = str2.rfind(
+        str1,
+        0 if after == -1 else max(2 * offset - after, 0),
+        min(offset + len(str1) - 1, end)
+    )
+    if before == -1 or after != -1 and after - offset <= offset - before:
+        return after
+    return before
+
+def get_reusable_blocks(data1, data2, prevHnd):
+    # decode a previous patch from data1 to an earlier version of data2; find
+    # the parts of its blocks that still produce the same bytes in data2 by
+    # comparing CRC32s of chunks (blocks are split at changed chunks); return
+    # {position in data2: (action, position to copy from, length), ...}
+
+    # get patch size without disturbing file handle position
+    patchPos = prevHnd.tell()
+    patchSize = prevHnd.seek(0, 2)
+    prevHnd.seek(patchPos)
+
+    # header
+    if read_bytes(4, prevHnd) != b"BPS1":
+        sys.exit("Previous patch is not a BPS patch.")
+    if read_int(prevHnd) != len(data1):
+        sys.exit("Previous patch was created from a different original file.")
+    read_int(prevHnd)
+    prevHnd.seek(read_int(prevHnd), 1)  # skip metadata
+
+    # blocks
+    trace = []
+    prevData2 = decode_blocks(data1, prevHnd, False, trace)
+
+    # footer
+    prevHnd.seek(patchSize - FOOTER_SIZE)
+    prevSrcCrc = struct.unpack("<L", read_bytes(4, prevHnd))[0]
+    if prevSrcCrc != parallel_crc32(data1):
+        sys.exit("Previous patch was created from a different original file.")
+
+    # isDirty[i] = has chunk i of data2 changed?
+    prevChunkCrcs = get_chunk_crcs(prevData2, UPDATE_CHUNK_SIZE)
+    isDirty = [
+        i >= len(prevChunkCrcs) or crc != prevChunkCrcs[i]
+        or min((i + 1) * UPDATE_CHUNK_SIZE, len(prevData2))
+        != min((i + 1) * UPDATE_CHUNK_SIZE, len(data2))
+        for (i, crc)
+        in enumerate(get_chunk_crcs(data2, UPDATE_CHUNK_SIZE))
+    ]
+
+    blocks = {}
+    for (action, dstAddr, srcAddr, length) in trace:
+        end = min(dstAddr + length, len(data2))
+        # distance to the bytes a TARGET_COPY block copies; they must be
+        # unchanged too
+        trgCopyDist = dstAddr - srcAddr if action == TARGET_COPY else 0
+        pos = dstAddr
+        cleanStart = -1  # start of unchanged part (-1 = none)
+        while pos < end:
+            # the part of the block that lies in one chunk (and copies from
+            # one chunk)
+            chunk = pos // UPDATE_CHUNK_SIZE
+            copyChunk = (pos - trgCopyDist) // UPDATE_CHUNK_SIZE
+            isClean = not isDirty[chunk] and not isDirty[copyChunk]
+            if isClean and cleanStart == -1:
+                cleanStart = pos
+            elif not isClean and cleanStart != -1:
+                blocks[cleanStart] = (
+                    action, srcAddr + cleanStart - dstAddr, pos - cleanStart
+                )
+                cleanStart = -1
+            pos = min(
+                (chunk + 1) * UPDATE_CHUNK_SIZE,
+                (copyChunk + 1) * UPDATE_CHUNK_SIZE + trgCopyDist, end
+            )
+        if cleanStart != -1:
+            blocks[cleanStart] = (
+                action, srcAddr + cleanStart - dstAddr, end - cleanStart
+            )
+    return blocks
+
 def create_bps(handle1, handle2, args):
     # create a BPS patch from the difference of two files;
     # generate patch data except for the patch CRC at the end;
@@ -101,6 +173,9 @@ def create_bps(handle1, handle2, args):
     handle2.seek(0)
     data2 = handle2.read()
 
+    # start computing CRCs for the footer in the background
+    crcJobs = (start_crc32(data1), start_crc32(data2))
+
     # header (id, original file size, patched file size, metadata size)
     yield b"BPS1"
     yield b"".join(
@@ -111,15 +186,30 @@ def create_bps(handle1, handle2, args):
     if args.metadata:
         yield args.metadata.encode("ascii")
 
+    # blocks reused from the previous patch, if any: {position in data2:
+    # (action, position to copy from, length), ...}
+    if args.update_from:
+        with open_patch(args.update_from) as prevHnd:
+            keptBlocks = get_reusable_blocks(data1, data2, prevHnd)
+    else:
+        keptBlocks = {}
+    keptStarts = sorted(keptBlocks)
+    nextKeptInd = 0  # index to keptStarts
+
     # unique minimum-length substrings in original/patched file;
-    # these speed up the encoder a lot but also take a lot of memory;
-    # for the patched file, the set must be built incrementally because the
-    # decoder can't read data it has not yet written
-    data1MinSubstrs = frozenset(
-        data1[i:i+args.min_copy_len]
-        for i in range(0, len(data1) - args.min_copy_len + 1, 1)
-    )
-    data2MinSubstrs = set()
+    # these speed up the encoder a lot but also take a lot of memory and time
+    # to build; for the patched file, the set must be built incrementally
+    # because the decoder can't read data it has not yet written;
+    # when reusing a previous patch, only the changed regions are searched, so
+    # the files are searched directly instead until that gets too slow
+    if args.update_from:
+        data1MinSubstrs = data2MinSubstrs = None
+    else:
+        data1MinSubstrs = frozenset(
+            get_substrings(data1, args.min_copy_len, 0, len(data1))
+        )
+        data2MinSubstrs = set()
+    directSearchCnt = 0  # number of searches without the sets
 
     data2Pos = 0       # position in data2
     prevData2Pos = 0   # previous position in data2
@@ -128,39 +218,99 @@ def create_bps(handle1, handle2, args):
     trgCopyOffset = 0  # TARGET_COPY's position in data2
 
     while data2Pos < len(data2):
-        # add minimum-length substrings that the decoder has become aware of
-        # on the previous round
-        data2MinSubstrs.update(
-            data2[i:i+args.min_copy_len] for i in range(
-                max(prevData2Pos - args.min_copy_len + 1, 0),
-                max(data2Pos - args.min_copy_len + 1, 0),
-            )
-        )
-        prevData2Pos = data2Pos
-
-        # find longest prefix of data2 in data1 and data2 (so far);
-        # optimize for speed by checking minimum length first
-        if data2[data2Pos:data2Pos+args.min_copy_len] in data1MinSubstrs:
-            data1CopyLen = find_longest_prefix(data2[data2Pos:], data1)
-        else:
-            data1CopyLen = 0
-        if data2[data2Pos:data2Pos+args.min_copy_len] in data2MinSubstrs:
-            data2CopyLen \
-            = find_longest_prefix(data2[data2Pos:], data2[:data2Pos])
+        if data2Pos in keptBlocks:
+            # reuse a block from the previous patch
+            (action, copyPos, length) = keptBlocks[data2Pos]
+            nextKeptInd += 1
         else:
-            data2CopyLen = 0
-
-        # choose action
-        if data1CopyLen >= max(data2CopyLen, args.min_copy_len):
-            if data1[data2Pos:data2Pos+data1CopyLen] \
-            == data2[data2Pos:data2Pos+data1CopyLen]:
-                action = SOURCE_READ
+            # search for matches; they must not extend to the next reused
+            # block
+            if nextKeptInd < len(keptStarts):
+                searchEnd = keptStarts[nextKeptInd]
             else:
-                action = SOURCE_COPY
-        elif data2CopyLen >= args.min_copy_len:
-            action = TARGET_COPY
-        else:
-            action = TARGET_READ
+                searchEnd = len(data2)
+
+            if data1MinSubstrs is None \
+            and directSearchCnt == MAX_DIRECT_SEARCHES:
+                # searching directly has become slower than the sets
+                data1MinSubstrs = frozenset(
+                    get_substrings(data1, args.min_copy_len, 0, len(data1))
+                )
+                data2MinSubstrs = set()
+                prevData2Pos = 0
+
+            # find longest prefix of data2 in data1 and data2 (so far);
+            # optimize for speed by checking minimum length first
+            toFind = data2[data2Pos:searchEnd]
+            minSubstr = toFind[:args.min_copy_len]
+            if data1MinSubstrs is None:
+                isInData1 = data1.find(minSubstr) != -1
+                isInData2 = data2.find(minSubstr, 0, data2Pos) != -1
+                directSearchCnt += 1
+            else:
+                # add minimum-length substrings that the decoder has become
+                # aware of since the previous search
+                data2MinSubstrs.update(get_substrings(
+                    data2, args.min_copy_len, prevData2Pos, data2Pos
+                ))
+                prevData2Pos = data2Pos
+                isInData1 = minSubstr in data1MinSubstrs
+                isInData2 = minSubstr in data2MinSubstrs
+            if isInData1:
+                data1CopyLen = find_longest_prefix(toFind, data1, len(data1))
+            else:
+                data1CopyLen = 0
+            if isInData2:
+                data2CopyLen = find_longest_prefix(toFind, data2, data2Pos)
+            else:
+                data2CopyLen = 0
+
+            # candidate blocks as (action, position to copy from, length,
+            # bytes needed for the offset): the longest matches nearest to
+            # srcCopyOffset/trgCopyOffset, and shorter matches that need no
+            # offset (SOURCE_READ) or a zero offset (continue from the
+            # previous SOURCE_COPY/TARGET_COPY)
+            candidates = []
+            if data1CopyLen >= args.min_copy_len:
+                candidates.append((
+                    SOURCE_READ, data2Pos,
+                    get_common_prefix_len(toFind, data1, data2Pos, len(data1)),
+                    0
+                ))
+                candidates.append((
+                    SOURCE_COPY, srcCopyOffset, get_common_prefix_len(
+                        toFind, data1, srcCopyOffset, len(data1)
+                    ), 1
+                ))
+                copyPos = find_nearest(
+                    toFind[:data1CopyLen], data1, srcCopyOffset, len(data1)
+                )
+                candidates.append((
+                    SOURCE_COPY, copyPos, data1CopyLen,
+                    len(encode_signed_int(copyPos - srcCopyOffset))
+                ))
+            if data2CopyLen >= args.min_copy_len:
+                candidates.append((
+                    TARGET_COPY, trgCopyOffset, get_common_prefix_len(
+                        toFind, data2, trgCopyOffset, data2Pos
+                    ), 1
+                ))
+                copyPos = find_nearest(
+                    toFind[:data2CopyLen], data2, trgCopyOffset, data2Pos
+                )
+                candidates.append((
+                    TARGET_COPY, copyPos, data2CopyLen,
+                    len(encode_signed_int(copyPos - trgCopyOffset))
+                ))
+            candidates = [c for c in candidates if c[2] >= args.min_copy_len]
+
+            # choose action; prefer the most bytes output per offset byte
+            if candidates:
+                (action, copyPos, length, offsetLen) \
+                = max(candidates, key=lambda c: c[2] - c[3])
+            else:
+                action = TARGET_READ
+                length = 1
 
         # end a TARGET_READ block before any other block
         if action != TARGET_READ and trgReadStart != -1:
@@ -171,28 +321,21 @@ def create_bps(handle1, handle2, args):
 
         if action == SOURCE_READ:
             # tell decoder to copy from current position in data1
-            yield block_start(data1CopyLen, SOURCE_READ)
-            data2Pos += data1CopyLen
+            yield block_start(length, SOURCE_READ)
         elif action == SOURCE_COPY:
             # tell decoder to copy from specified position in data1
-            copyPos = data1.index(data2[data2Pos:data2Pos+data1CopyLen])
-            yield block_start(data1CopyLen, SOURCE_COPY)
+            yield block_start(length, SOURCE_COPY)
             yield encode_signed_int(copyPos - srcCopyOffset)
-            srcCopyOffset = copyPos + data1CopyLen
-            data2Pos += data1CopyLen
+            srcCopyOffset = copyPos + length
         elif action == TARGET_COPY:
             # tell decoder to copy from specified position in data2
-            copyPos \
-            = data2[:data2Pos].index(data2[data2Pos:data2Pos+data2CopyLen])
-            yield block_start(data2CopyLen, TARGET_COPY)
+            yield block_start(length, TARGET_COPY)
             yield encode_signed_int(copyPos - trgCopyOffset)
-            trgCopyOffset = copyPos + data2CopyLen
-            data2Pos += data2CopyLen
-        else:
-            # TARGET_READ; start a new block if necessary
-            if trgReadStart == -1:
-                trgReadStart = data2Pos
-            data2Pos += 1
+            trgCopyOffset = copyPos + length
+        elif trgReadStart == -1:
+            # TARGET_READ; start a new block
+            trgReadStart = data2Pos
+        data2Pos += length
 
     # end final TARGET_READ block
     if trgReadStart != -1:
@@ -200,31 +343,32 @@ def create_bps(handle1, handle2, args):
         yield data2[trgReadStart:]
 
     # footer except for patch CRC (source/target file CRC)
-    yield struct.pack("<2L", crc32(data1), crc32(data2))
+    yield struct.pack("<2L", *(finish_crc32(jobs) for jobs in crcJobs))
 
-def main():
-    startTime = time.time()
-    args = parse_args()
-
-    # create patch data
+def write_bps(origPath, modifiedPath, patchPath, args):
+    # create a BPS patch from the differences of two files, including the
+    # patch CRC, and write it
     try:
-        with open(args.orig_file, "rb") as handle1, \
-        open(args.modified_file, "rb") as handle2:
+        with open(origPath, "rb") as handle1, \
+        open(modifiedPath, "rb") as handle2:
             patch = bytearray()
             for chunk in create_bps(handle1, handle2, args):
                 patch.extend(chunk)
-            patch.extend(struct.pack("<L", crc32(patch)))
+            patch.extend(struct.pack("<L", parallel_crc32(patch)))
     except OSError:
         sys.exit("Error reading input files.")
 
-    # write patch data
     try:
-        with open(args.patch_file, "wb") as handle:
-            handle.seek(0)
+        with open_patch_for_writing(patchPath) as handle:
             handle.write(patch)
     except OSError:
         sys.exit("Error writing output file.")
 
+def main():
+    startTime = time.time()
+    args = parse_args()
+    write_bps(args.orig_file, args.modified_file, args.patch_file, args)
     print("Time:", format(time.time() - startTime, ".1f"), "s")
 
-main()
+if __name__ == "__main__":
+    main()
@@ -1,85 +1,89 @@
 import argparse, os, sys
+from qromp_cli import (
+    add_create_arguments, add_create_ips_options, check_create_args
+)
+from qromp_compress import open_patch_for_writing
 
 MAX_BLK_LEN = 0xffff  # maximum length of any block
+READ_CHUNK_SIZE = 1024 * 1024  # how many bytes to compare at a time
+CMP_SLICE_SIZE = 64  # how many bytes to compare at a time in changed chunks
 
 def parse_args():
     # parse command line arguments
-
     parser = argparse.ArgumentParser(
         description="Qalle's IPS Patch Creator. Creates an IPS patch from the "
-        "differences of two files. Somewhat inefficient."
-    )
-
-    parser.add_argument(
-        "--min-rle-len", type=int, default=9,
-        help="Minimum length of blocks to encode as RLE. 1-16, default=9. "
-        "Affects efficiency."
-    )
-    parser.add_argument(
-        "--max-unchg-len", type=int, default=1,
-        help="Maximum length of unchanged substring to store. 0-16, "
-        "default=1. Affects efficiency."
-    )
-
-    parser.add_argument(
-        "orig_file", help="Original file to read."
-    )
-    parser.add_argument(
-        "modified_file",
-        help="File to read and compare against orig_file. Must be at least as "
-        "large as orig_file."
+        "differences of two files. Somewhat inefficient. Files larger than "
+        "16 MiB get an IPS32 patch."
     )
-    parser.add_argument(
-        "patch_file", help="Patch file to write (.ips)."
-    )
-
+    add_create_ips_options(parser)
+    add_create_arguments(parser, ".ips")
     args = parser.parse_args()
-
-    if not 1 <= args.min_rle_len <= 16:
-        sys.exit("Invalid '--min-rle-len' value.")
-    if not 0 <= args.max_unchg_len <= 16:
-        sys.exit("Invalid '--max-unchg-len' value.")
-
-    if not os.path.isfile(args.orig_file):
-        sys.exit("Original file not found.")
-    if not os.path.isfile(args.modified_file):
-        sys.exit("Modified file not found.")
-    if os.path.exists(args.patch_file):
-        sys.exit("Output file already exists.")
-
+    check_create_args(args)
     return args
 
-def get_blocks(data1, data2):
-    # generate (start, length) of blocks that differ
+def read_chunks(handle1, handle2, size):
+    # read the first size bytes of two files in chunks; generate
+    # (position, chunk1, chunk2)
+    handle1.seek(0)
+    handle2.seek(0)
+    for pos in range(0, size, READ_CHUNK_SIZE):
+        chunkSize = min(size - pos, READ_CHUNK_SIZE)
+        yield (pos, handle1.read(chunkSize), handle2.read(chunkSize))
+
+def get_blocks(handle1, handle2, size1, size2):
+    # generate (start, length) of blocks that differ; the files are read in
+    # chunks and only changed slices of chunks are compared byte by byte
 
     start = -1  # start position of current block (-1 = none)
 
-    for (pos, (byte1, byte2)) in enumerate(zip(data1, data2)):
-        if start == -1 and byte1 != byte2:
-            # start a block
-            start = pos
-        elif start != -1 and byte1 == byte2:
-            # end a block
-            yield (start, pos - start)
-            start = -1
-        elif start != -1 and pos - start == MAX_BLK_LEN:
-            # end a block and start a new one
-            yield (start, pos - start)
-            start = pos
+    for (chunkPos, chunk1, chunk2) in read_chunks(
+        handle1, handle2, min(size1, size2)
+    ):
+        if chunk1 == chunk2:
+            if start != -1:
+                # end a block
+                yield (start, chunkPos - start)
+                start = -1
+            continue
+
+        for slicePos in range(0, len(chunk1), CMP_SLICE_SIZE):
+            slice1 = chunk1[slicePos:slicePos+CMP_SLICE_SIZE]
+            slice2 = chunk2[slicePos:slicePos+CMP_SLICE_SIZE]
+            if slice1 == slice2:
+                if start != -1:
+                    # end a block
+                    yield (start, chunkPos + slicePos - start)
+                    start = -1
+                continue
+
+            for (pos, (byte1, byte2)) in enumerate(
+                zip(slice1, slice2), chunkPos + slicePos
+            ):
+                if start == -1 and byte1 != byte2:
+                    # start a block
+                    start = pos
+                elif start != -1 and byte1 == byte2:
+                    # end a block
+                    yield (start, pos - start)
+                    start = -1
+                elif start != -1 and pos - start == MAX_BLK_LEN:
+                    # end a block and start a new one
+                    yield (start, pos - start)
+                    start = pos
 
     if start != -1:
         # end the last block shared by both files
-        yield (start, len(data1) - start)
+        yield (start, min(size1, size2) - start)
 
     # data after end of first file, if any
-    for start in range(len(data1), len(data2), MAX_BLK_LEN):
-        yield (start, min(len(data2) - start, MAX_BLK_LEN))
+    for start in range(size1, size2, MAX_BLK_LEN):
+        yield (start, min(size2 - start, MAX_BLK_LEN))
 
-def get_optimized_blocks(data1, data2, args):
+def get_optimized_blocks(handle1, handle2, size1, size2, args):
     # generate (start, length) of blocks that differ, with some blocks merged
 
     blockBuf = []  # blocks not generated yet
-    for (start, length) in get_blocks(data1, data2):
+    for (start, length) in get_blocks(handle1, handle2, size1, size2):
         blockBuf.append((start, length))
         # if gap between last two blocks is too large
         # or the whole buffer is too large...
@@ -95,12 +99,18 @@ def get_optimized_blocks(data1, data2, args):
         # output remaining blocks
         yield (blockBuf[0][0], sum(blockBuf[-1]) - blockBuf[0][0])
 
-def get_subblocks(data1, data2, args):
+def get_subblocks(handle1, handle2, size1, size2, args):
     # split blocks that differ into RLE and non-RLE subblocks;
-    # generate (start, length, is_RLE)
+    # generate (start, length, is_RLE, data)
 
-    for (blkStart, blkLen) in get_optimized_blocks(data1, data2, args):
-        block = data2[blkStart:blkStart+blkLen]
+    for (blkStart, blkLen) in get_optimized_blocks(
+        handle1, handle2, size1, size2, args
+    ):
+        # get_blocks() reads the files sequentially, so restore the position
+        origPos = handle2.tell()
+        handle2.seek(blkStart)
+        block = handle2.read(blkLen)
+        handle2.seek(origPos)
 
         # split block into RLE/non-RLE subblocks;
         # e.g. ABBCCCCDDDDDEF -> ABB, 4*C, 5*D, EF
@@ -122,8 +132,14 @@ def get_subblocks(data1, data2, args):
                     rleLen = 0
                 else:
                     if nonRleLen:
-                        yield (blkStart + subStart, nonRleLen, False)
-                    yield (blkStart + subStart + nonRleLen, rleLen, True)
+                        yield (
+                            blkStart + subStart, nonRleLen, False,
+                            block[subStart:subStart+nonRleLen]
+                        )
+                    yield (
+                        blkStart + subStart + nonRleLen, rleLen, True,
+                        block[subPos-1:subPos]
+                    )
                     subStart = subPos
 
         # same for the last byte in block
@@ -133,9 +149,14 @@ def get_subblocks(data1, data2, args):
             nonRleLen += rleLen
             rleLen = 0
         if nonRleLen:
-            yield (blkStart + subStart, nonRleLen, False)
+            yield (
+                blkStart + subStart, nonRleLen, False,
+                block[subStart:subStart+nonRleLen]
+            )
         if rleLen:
-            yield (blkStart + subStart + nonRleLen, rleLen, True)
+            yield (
+                blkStart + subStart + nonRleLen, rleLen, True, block[-1:]
+            )
 
 def encode_int(n, byteCnt):
     # encode an IPS integer (unsigned, most significant byte first)
@@ -144,52 +165,56 @@ def encode_int(n, byteCnt):
 def create_ips(handle1, handle2, args):
     # create an IPS patch from the differences of handle1 and handle2;
     # generate patch data; note: has the "EOF" address (0x454f46) bug;
+    # if the second file is larger than 16 MiB, create an IPS32 patch (4-byte
+    # offsets, "IPS32" header, "EEOF" footer);
+    # if the second file is smaller, end the patch with its size (truncation);
     # see https://zerosoft.zophar.net/ips.php
 
-    handle1.seek(0)
-    origData = handle1.read()
-    handle2.seek(0)
-    newData = handle2.read()
+    size1 = handle1.seek(0, 2)
+    size2 = handle2.seek(0, 2)
 
-    yield b"PATCH"  # file format id
+    if size2 > 2 ** 24 or size1 > size2 > 0xffffff:
+        (fileId, offsetSize, eofMarker) = (b"IPS32", 4, b"EEOF")
+    else:
+        (fileId, offsetSize, eofMarker) = (b"PATCH", 3, b"EOF")
 
-    for (start, length, isRle) in get_subblocks(origData, newData, args):
-        yield encode_int(start, 3)
+    yield fileId
+
+    for (start, length, isRle, data) in get_subblocks(
+        handle1, handle2, size1, size2, args
+    ):
+        yield encode_int(start, offsetSize)
         if isRle:
             yield encode_int(0, 2)
             yield encode_int(length, 2)
-            yield newData[start:start+1]
         else:
             yield encode_int(length, 2)
-            yield newData[start:start+length]
+        yield data
 
-    yield b"EOF"
+    yield eofMarker
 
-def main():
-    args = parse_args()
+    if size1 > size2:
+        yield encode_int(size2, offsetSize)
+
+def write_ips(origPath, modifiedPath, patchPath, args):
+    # create an IPS patch from the differences of two files and write it as
+    # it's generated, so memory use doesn't depend on the size of the patch;
+    # delete the incomplete patch file on error
 
-    # create patch data
-    patch = bytearray()
     try:
-        with open(args.orig_file, "rb") as handle1, \
-        open(args.modified_file, "rb") as handle2:
-            if max(handle1.seek(0, 2), handle2.seek(0, 2)) > 2 ** 24:
-                sys.exit("Input files must not be larger than 16 MiB.")
-            if handle1.seek(0, 2) > handle2.seek(0, 2):
-                sys.exit(
-                    "Second input file must not be smaller than first one."
-                )
+        with open(origPath, "rb") as handle1, \
+        open(modifiedPath, "rb") as handle2, \
+        open_patch_for_writing(patchPath) as patchHnd:
             for bytes_ in create_ips(handle1, handle2, args):
-                patch.extend(bytes_)
+                patchHnd.write(bytes_)
     except OSError:
-        sys.exit("Error reading input files.")
+        if os.path.exists(patchPath):
+            os.remove(patchPath)
+        sys.exit("Error reading input files or writing output file.")
 
-    # write patch data
-    try:
-        with open(args.patch_file, "wb") as handle:
-            handle.seek(0)
-            handle.write(patch)
-    except OSError:
-        sys.exit("Error writing output file.")
+def main():
+    args = parse_args()
+    write_ips(args.orig_file, args.modified_file, args.patch_file, args)
 
-main()
+if __name__ == "__main__":
+    main()
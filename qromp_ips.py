@@ -1,39 +1,19 @@
-import argparse, os, sys
+import sys
 from zlib import crc32
+from qromp_cli import add_apply_arguments, check_apply_args, write_patched_file
+from qromp_compress import open_patch
 
 def parse_args():
-    # parse command line arguments
-
+    # parse command line arguments; argparse is imported here because
+    # qromp.py uses this module and usually doesn't need it
+    import argparse
     parser = argparse.ArgumentParser(
-        description="Qalle's IPS Patcher. Applies an IPS patch to a file. Has "
-        "the 'EOF' address (0x454f46) bug."
-    )
-
-    parser.add_argument(
-        "-v", "--verbose", action="store_true",
-        help="Print more info. (CRC32 checksums are of zlib variety and "
-        "hexadecimal.)"
-    )
-
-    parser.add_argument(
-        "orig_file", help="Original (unpatched) file to read."
-    )
-    parser.add_argument(
-        "patch_file", help="Patch file (.ips) to read."
+        description="Qalle's IPS Patcher. Applies an IPS or IPS32 patch to a "
+        "file. Has the 'EOF' address (0x454f46) bug."
     )
-    parser.add_argument(
-        "output_file", help="Patched copy of orig_file to write."
-    )
-
+    add_apply_arguments(parser, ".ips", False)
     args = parser.parse_args()
-
-    if not os.path.isfile(args.orig_file):
-        sys.exit("Original file not found.")
-    if not os.path.isfile(args.patch_file):
-        sys.exit("Patch file not found.")
-    if os.path.exists(args.output_file):
-        sys.exit("Output file already exists.")
-
+    check_apply_args(args)
     return args
 
 def read_bytes(n, handle):
@@ -47,18 +27,21 @@ def decode_int(bytes_):
     # decode an IPS integer (unsigned, most significant byte first)
     return sum(b << (8 * i) for (i, b) in enumerate(bytes_[::-1]))
 
-def get_blocks(handle):
-    # read IPS file starting from after header;
+def get_blocks(handle, eofMarker):
+    # read IPS file starting from after header until eofMarker (b"EOF" for
+    # IPS, b"EEOF" for IPS32, also the size of offsets);
     # generate each block as (patch_pos, offset, length, is_RLE, data);
     # for RLE blocks, data is one byte
 
     while True:
         patchPos = handle.tell()
-        offset = decode_int(read_bytes(3, handle))
+        offsetBytes = read_bytes(len(eofMarker), handle)
 
-        if offset == 0x454f46:  # "EOF"
+        if offsetBytes == eofMarker:
             break
 
+        offset = decode_int(offsetBytes)
+
         length = decode_int(read_bytes(2, handle))
         if length == 0:
             # RLE
@@ -68,8 +51,35 @@ def get_blocks(handle):
             # non-RLE
             yield (patchPos, offset, length, False, read_bytes(length, handle))
 
+def get_block_stats(handle, eofMarker):
+    # read blocks like get_blocks() without using them; return (number of
+    # blocks by type, bytes output by type, end of last byte written);
+    # type 0 = non-RLE, 1 = RLE
+
+    blkCnts = 2 * [0]
+    blkByteCnts = 2 * [0]
+    maxEnd = 0
+    for (patchPos, offset, length, isRle, blockData) \
+    in get_blocks(handle, eofMarker):
+        blkCnts[isRle] += 1
+        blkByteCnts[isRle] += length
+        maxEnd = max(maxEnd, offset + length)
+    return (blkCnts, blkByteCnts, maxEnd)
+
+def print_block_stats(blkCnts, blkByteCnts):
+    # print statistics from get_block_stats()
+    print("Blocks by type:")
+    for bt in range(2):
+        descr = ("non-RLE", "RLE")[bt]
+        print(
+            f"- {blkByteCnts[bt]} bytes output by {blkCnts[bt]} {descr} "
+            "blocks"
+        )
+
 def apply_ips(origHnd, patchHnd, verbose):
-    # apply IPS patch from patchHnd to origHnd, return patched data;
+    # apply IPS or IPS32 patch from patchHnd to origHnd, return patched data;
+    # IPS32 has 4-byte offsets, "IPS32" header and "EEOF" footer; the footer
+    # may be followed by the size to truncate the data to;
     # see https://zerosoft.zophar.net/ips.php
 
     origHnd.seek(0)
@@ -80,38 +90,45 @@ def apply_ips(origHnd, patchHnd, verbose):
 
     patchHnd.seek(0)
 
-    if read_bytes(5, patchHnd) != b"PATCH":
+    id_ = read_bytes(5, patchHnd)
+    if id_ == b"PATCH":
+        eofMarker = b"EOF"
+    elif id_ == b"IPS32":
+        eofMarker = b"EEOF"
+    else:
         sys.exit("Not an IPS patch.")
-
     if verbose:
+        print(f"Format: {'IPS' if id_ == b'PATCH' else 'IPS32'}.")
         print(
             "Address in patch file / address in original file / block type / "
             "bytes to output:"
         )
-        # statistics by block type
-        blkCnts = 2 * [0]
-        blkByteCnts = 2 * [0]
 
-    for (patchPos, offset, length, isRle, blockData) in get_blocks(patchHnd):
+    for (patchPos, offset, length, isRle, blockData) in get_blocks(
+        patchHnd, eofMarker
+    ):
         if offset > len(data):
             sys.exit("Tried to write past end of data.")
         data[offset:offset+length] = (length if isRle else 1) * blockData
         if verbose:
-            blkCnts[isRle] += 1
-            blkByteCnts[isRle] += length
             descr = "RLE" if isRle else "non-RLE"
             print(f"{patchPos:10} {offset:10} {descr:7} {length:10}")
 
     if verbose:
-        eofPos = patchHnd.seek(0, 2) - 3
-        print(f"{eofPos:10} {'-':>10} {'EOF':7} {'-':>10}")
-        print("Blocks by type:")
-        for bt in range(2):
-            descr = ("non-RLE", "RLE")[bt]
-            print(
-                f"- {blkByteCnts[bt]} bytes output by {blkCnts[bt]} {descr} "
-                "blocks"
-            )
+        eofPos = patchHnd.tell() - len(eofMarker)
+        print(f"{eofPos:10} {'-':>10} {eofMarker.decode():7} {'-':>10}")
+
+    # truncation (size after footer)
+    truncSize = patchHnd.read(len(eofMarker))
+    if len(truncSize) == len(eofMarker):
+        truncSize = decode_int(truncSize)
+        if verbose:
+            print(f"Truncating to {truncSize} bytes.")
+        del data[truncSize:]
+
+    if verbose:
+        patchHnd.seek(len(id_))
+        print_block_stats(*get_block_stats(patchHnd, eofMarker)[:2])
         print(f"CRC32 of output file: {crc32(data):08x}.")
 
     return data
@@ -122,17 +139,12 @@ def main():
     # create patched data
     try:
         with open(args.orig_file, "rb") as origHnd, \
-        open(args.patch_file, "rb") as patchHnd:
+        open_patch(args.patch_file) as patchHnd:
             patchedData = apply_ips(origHnd, patchHnd, args.verbose)
     except OSError:
         sys.exit("Error reading input files.")
 
-    # write patched data
-    try:
-        with open(args.output_file, "wb") as handle:
-            handle.seek(0)
-            handle.write(patchedData)
-    except OSError:
-        sys.exit("Error writing output file.")
+    write_patched_file(args.output_file, patchedData)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,12 @@ echo "=== Verifying patched files ==="
 md5sum -c --quiet test-dec-bps.md5
 echo
 
+echo "=== Creating and applying a reverse patch ==="
+python3 qromp_bps.py test-in-orig/smb1e.nes test-in-bps/smb1e-fin.bps test-out/smb1e-fin-2.nes -r test-out/smb1e-fin-rev.bps
+python3 qromp_bps.py test-out/smb1e-fin-2.nes test-out/smb1e-fin-rev.bps test-out/smb1e-unpatched.nes
+cmp test-in-orig/smb1e.nes test-out/smb1e-unpatched.nes
+echo
+
 echo "=== Five distinct errors and one warning ==="
 # input1 not found, input2 not found, output already exists, not a BPS file,
 # read from invalid position
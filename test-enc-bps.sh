@@ -34,6 +34,34 @@ python3 qromp_bps.py test-in-orig/smb3u.nes     test-out/smb3u-marioadv.bps
 md5sum -c --quiet test-enc-bps.md5
 echo
 
+echo "=== Updating a BPS patch, verifying patched file ==="
+python3 qromp_enc_bps.py test-in-orig/smb1e.nes test-in-patched/smb1e-fin.nes test-out/smb1e-fin-upd.bps --update-from test-in-bps/smb1e-fin.bps
+python3 qromp_bps.py     test-in-orig/smb1e.nes test-out/smb1e-fin-upd.bps    test-out/smb1e-fin-upd.nes
+cmp test-in-patched/smb1e-fin.nes test-out/smb1e-fin-upd.nes
+# edit the patched file in a few places and append data so that some chunks
+# differ from the output of the previous patch
+cp test-in-patched/smb1e-fin.nes test-out/smb1e-fin-edit.nes
+printf 'EDITED' | dd of=test-out/smb1e-fin-edit.nes bs=1 seek=4200  conv=notrunc status=none
+printf 'EDITED' | dd of=test-out/smb1e-fin-edit.nes bs=1 seek=20000 conv=notrunc status=none
+head -c 3000 test-in-orig/smb1e.nes >> test-out/smb1e-fin-edit.nes
+python3 qromp_enc_bps.py test-in-orig/smb1e.nes test-out/smb1e-fin-edit.nes test-out/smb1e-fin-edit.bps --update-from test-in-bps/smb1e-fin.bps
+python3 qromp_bps.py     test-in-orig/smb1e.nes test-out/smb1e-fin-edit.bps    test-out/smb1e-fin-edit2.nes
+cmp test-out/smb1e-fin-edit.nes test-out/smb1e-fin-edit2.nes
+echo
+
+echo "=== Creating and applying patches for files larger than 1 MiB ==="
+# CRC32s of these are computed in chunks on a thread pool and combined
+head -c 3000000 /dev/urandom > test-out/big-orig.bin
+cp test-out/big-orig.bin test-out/big-edit.bin
+printf 'EDITED' | dd of=test-out/big-edit.bin bs=1 seek=1500000 conv=notrunc status=none
+head -c 100000 test-out/big-orig.bin >> test-out/big-edit.bin
+python3 qromp_enc_bps.py test-out/big-orig.bin test-out/big-edit.bin test-out/big-edit.bps
+python3 qromp_bps.py     test-out/big-orig.bin test-out/big-edit.bps  test-out/big-edit2.bin -r test-out/big-rev.bps
+cmp test-out/big-edit.bin test-out/big-edit2.bin
+python3 qromp_bps.py     test-out/big-edit2.bin test-out/big-rev.bps  test-out/big-orig2.bin
+cmp test-out/big-orig.bin test-out/big-orig2.bin
+echo
+
 echo "=== Three distinct errors ==="
 # input1 not found, input2 not found, output already exists
 python3 qromp_enc_bps.py nonexistent            test-in-orig/smb1e.nes test-out/temp1.bps
@@ -33,11 +33,37 @@ python3 qromp_ips.py test-in-orig/smb3u.nes       test-out/smb3u-mix.ips
 md5sum -c --quiet test-enc-ips.md5
 echo
 
-echo "=== Four distinct errors ==="
-# input1 not found, input2 not found, output already exists, input2 smaller
-# than input1
+echo "=== Creating and applying a compressed IPS patch ==="
+python3 qromp_enc_ips.py test-in-orig/smb1e.nes test-in-patched/smb1e-fin.nes test-out/smb1e-fin.ips.xz
+python3 qromp_ips.py     test-in-orig/smb1e.nes test-out/smb1e-fin.ips.xz    test-out/smb1e-fin-xz.nes
+cmp test-in-patched/smb1e-fin.nes test-out/smb1e-fin-xz.nes
+echo
+
+echo "=== Creating and applying a truncating IPS patch ==="
+python3 qromp_enc_ips.py test-in-orig/smb2e.nes test-in-orig/smb1e.nes   test-out/smb2e-to-smb1e.ips
+python3 qromp_ips.py     test-in-orig/smb2e.nes test-out/smb2e-to-smb1e.ips test-out/smb1e.nes
+cmp test-in-orig/smb1e.nes test-out/smb1e.nes
+echo
+
+echo "=== Creating and applying IPS32 patches (files larger than 16 MiB) ==="
+head -c 17000000 /dev/urandom > test-out/big-orig.bin
+cp test-out/big-orig.bin test-out/big-edit.bin
+printf 'EDITED' | dd of=test-out/big-edit.bin bs=1 seek=1000     conv=notrunc status=none
+printf 'EDITED' | dd of=test-out/big-edit.bin bs=1 seek=16800000 conv=notrunc status=none
+head -c 100000 test-out/big-orig.bin >> test-out/big-edit.bin
+head -c 16900000 test-out/big-edit.bin > test-out/big-trunc.bin
+python3 qromp_enc_ips.py test-out/big-orig.bin test-out/big-edit.bin  test-out/big-edit.ips
+python3 qromp_enc_ips.py test-out/big-orig.bin test-out/big-trunc.bin test-out/big-trunc.ips
+head -c 5 test-out/big-edit.ips; echo  # should print "IPS32"
+python3 qromp_ips.py     test-out/big-orig.bin test-out/big-edit.ips  test-out/big-edit2.bin
+python3 qromp_ips.py     test-out/big-orig.bin test-out/big-trunc.ips test-out/big-trunc2.bin
+cmp test-out/big-edit.bin  test-out/big-edit2.bin
+cmp test-out/big-trunc.bin test-out/big-trunc2.bin
+echo
+
+echo "=== Three distinct errors ==="
+# input1 not found, input2 not found, output already exists
 python3 qromp_enc_ips.py nonexistent            test-in-orig/smb1e.nes test-out/temp1.ips
 python3 qromp_enc_ips.py test-in-orig/smb1e.nes nonexistent            test-out/temp2.ips
 python3 qromp_enc_ips.py test-in-orig/smb1e.nes test-in-orig/smb1e.nes test-in-ips/nop.ips
-python3 qromp_enc_ips.py test-in-orig/smb2e.nes test-in-orig/smb1e.nes test-out/temp3.ips
 echo
@@ -0,0 +1,31 @@
+# Tests qromp.py. Assumes that the other programs work correctly.
+# Warning: this script deletes files. Run at your own risk.
+
+clear
+rm -f test-out/*
+
+echo "=== Printing info on patches ==="
+python3 qromp.py info test-in-bps/smb1e-fin.bps
+python3 qromp.py info test-in-ips/smb3u-mix.ips
+echo
+
+echo "=== Applying patches, verifying patched files ==="
+python3 qromp.py apply test-in-orig/smb1e.nes test-in-bps/smb1e-fin.bps test-out/smb1e-fin.nes
+python3 qromp.py apply test-in-orig/smb3u.nes test-in-ips/smb3u-mix.ips test-out/smb3u-mix.nes
+cmp test-in-patched/smb1e-fin.nes test-out/smb1e-fin.nes
+md5sum -c --quiet --ignore-missing test-dec-ips.md5
+echo
+
+echo "=== Creating patches, verifying them ==="
+python3 qromp.py create test-in-orig/smb1e.nes test-in-patched/smb1e-fin.nes test-out/smb1e-fin.bps --min-copy-len 8
+python3 qromp.py create test-in-orig/smb1e.nes test-in-patched/smb1e-fin.nes test-out/smb1e-fin.ips.gz
+python3 qromp.py verify test-in-orig/smb1e.nes test-out/smb1e-fin.bps
+python3 qromp.py verify test-in-orig/smb1e.nes test-out/smb1e-fin.ips.gz test-in-patched/smb1e-fin.nes
+echo
+
+echo "=== Three distinct errors ==="
+# unknown patch format, can't detect format to create, verification failed
+python3 qromp.py info   test-in-orig/smb1e.nes
+python3 qromp.py create test-in-orig/smb1e.nes test-in-patched/smb1e-fin.nes test-out/temp1.pat
+python3 qromp.py verify test-in-orig/smb1e.nes test-out/smb1e-fin.ips.gz     test-in-orig/smb1e.nes
+echo